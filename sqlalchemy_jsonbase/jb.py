@@ -1,5 +1,11 @@
 import types
-import inspect
+import keyword
+import weakref
+import warnings
+import threading
+import linecache
+import functools
+import itertools
 import collections
 import sqlalchemy as sa
 import marshmallow as mm
@@ -7,6 +13,7 @@ import marshmallow_jsonschema as mmjs
 import decimal as dec
 import datetime as dt
 
+from collections.abc import Mapping
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
 from sqlalchemy_utils import get_declarative_base
 
@@ -14,6 +21,22 @@ from sqlalchemy_utils import get_declarative_base
 ########################################################################################################################
 
 
+_FIELD_KEYS = ('label', 'format', 'missing', 'validate', 'field')
+
+
+def _field_info(kwargs):
+    """Pop the schema annotations out of a set of keyword arguments, and return them merged into its info dict."""
+    field_kwargs = {key: kwargs.pop(key) for key in _FIELD_KEYS if key in kwargs}
+
+    if 'label' in field_kwargs:
+        field_kwargs['title'] = field_kwargs.pop('label')
+
+    return {
+        **kwargs.pop('info', {}),
+        **field_kwargs,
+    }
+
+
 class jb_property:
     """An annotated property."""
 
@@ -23,16 +46,7 @@ class jb_property:
         self.fdel = fdel
         self.__doc__ = doc
 
-        field_keys = ('label', 'format', 'missing', 'validate', 'field')
-        field_kwargs = {key: kwargs.pop(key) for key in field_keys if key in kwargs}
-
-        if 'label' in field_kwargs:
-            field_kwargs['title'] = field_kwargs.pop('label')
-
-        self.info = {
-            **kwargs.pop('info', {}),
-            **field_kwargs,
-        }
+        self.info = _field_info(kwargs)
 
     def __call__(self, fn):
         self.fget = fn
@@ -63,37 +77,48 @@ class jb_property:
 ########################################################################################################################
 
 
-old_get_schema = mmjs.JSONSchema._get_schema_for_field
-old_from_nested = mmjs.JSONSchema._from_nested_schema
+# Keep the unpatched methods on the class, so that reloading this module doesn't wrap the patched versions
+if not getattr(mmjs.JSONSchema, '_jb_patched', False):
+    mmjs.JSONSchema._jb_get_schema_for_field = mmjs.JSONSchema._get_schema_for_field
+    mmjs.JSONSchema._jb_from_nested_schema = mmjs.JSONSchema._from_nested_schema
+    mmjs.JSONSchema._jb_patched = True
+
+old_get_schema = mmjs.JSONSchema._jb_get_schema_for_field
+old_from_nested = mmjs.JSONSchema._jb_from_nested_schema
 
 
 def fix_refs(root_schema, uri_prefix=''):
     """Convert foreign $refs to local, and local to foreign, based on the contents of the root_schema's definitions."""
-    root_name = root_schema['$ref'].split('/')[-1]
-    definitions = root_schema['definitions'].keys()
-
-    def schema_uri(class_name):
-        if class_name in definitions or class_name == root_name:
-            return f'#/definitions/{class_name}'
-        else:
-            return f'{uri_prefix}{class_name}#/definitions/{class_name}'
+    root_name = root_schema['$ref'].rsplit('/', 1)[-1]
+    uris = {name: f'#/definitions/{name}' for name in (root_name, *root_schema['definitions'])}
 
-    def _fix(doc):
+    stack = list(root_schema['definitions'].values())
+    while stack:
+        doc = stack.pop()
         for key, value in doc.items():
             if key == '$ref':
-                doc[key] = schema_uri(value.split('/')[-1])
+                class_name = value.rsplit('/', 1)[-1]
+                uri = uris.get(class_name)
+                if uri is None:
+                    uri = uris[class_name] = f'{uri_prefix}{class_name}#/definitions/{class_name}'
+                doc[key] = uri
             elif isinstance(value, dict):
-                doc[key] = _fix(value)
-        return doc
-
-    for name, schema in root_schema['definitions'].items():
-        _fix(schema)
+                stack.append(value)
 
     return root_schema
 
 
 def _get_schema_for_field(self, obj, field):
     """Patches JSONSchema's _get_schema_for_field method."""
+    if _is_relationship_field(field) and not hasattr(field, '_jsonschema_type_mapping') and \
+            '_jsonschema_type_mapping' not in field.metadata:
+        # JSONSchema maps fields by their exact class, so it doesn't recognize subclasses of Nested
+        schema = self._from_nested_schema(obj, field)
+        for validator in field.validators:
+            if validator.__class__ in mmjs.base.FIELD_VALIDATORS:
+                schema = mmjs.base.FIELD_VALIDATORS[validator.__class__](schema, field, validator, obj)
+        return schema
+
     schema = old_get_schema(self, obj, field)
     fkey = getattr(field, 'foreign_class', None)
     if fkey:
@@ -102,13 +127,17 @@ def _get_schema_for_field(self, obj, field):
     return schema
 
 
+# Definitions dumped for nested schemas, keyed on the schema class and its only/exclude params
+_nested_json_schemas = collections.OrderedDict()
+
+
 def _from_nested_schema(self, obj, field):
     """Patches JSONSchema's _from_nested_schema method."""
 
     follow = self.context.get('_follow', [])
     rel_class = getattr(field, 'related_class', None)
     nested_ctx = self.context.get(field.name, {})
-    nested_params = ViewSchema().load(nested_ctx).data
+    nested_params = _view_params(None, nested_ctx)
 
     if field.name in follow or field.name in self.context:
         if isinstance(field.nested, str):
@@ -124,13 +153,23 @@ def _from_nested_schema(self, obj, field):
         # If this is not a schema we've seen, and it's not this schema,
         # put it in our list of schema defs
         if name not in self._nested_schema_classes and name != outer_name:
-            wrapped_nested = mmjs.JSONSchema(nested=True)
-            wrapped_dumped = wrapped_nested.dump(
-                nested(only=only, exclude=exclude)
-            )
-            self._nested_schema_classes[name] = wrapped_dumped.data
+            key = (nested, _freeze(only), _freeze(exclude))
+            if key in _nested_json_schemas:
+                _nested_json_schemas.move_to_end(key)
+            else:
+                wrapped_nested = mmjs.JSONSchema(nested=True)
+                wrapped_dumped = wrapped_nested.dump(
+                    nested(only=only, exclude=exclude)
+                )
+                _nested_json_schemas[key] = (wrapped_dumped.data, wrapped_nested._nested_schema_classes)
+                if len(_nested_json_schemas) > _SCHEMA_CACHE_SIZE:
+                    _nested_json_schemas.popitem(last=False)
+
+            # fix_refs rewrites definitions in place, so each schema gets its own copy
+            nested_data, nested_classes = _nested_json_schemas[key]
+            self._nested_schema_classes[name] = _copy_containers(nested_data)
             self._nested_schema_classes.update(
-                wrapped_nested._nested_schema_classes
+                _copy_containers(nested_classes)
             )
 
         # and the schema is just a reference to the def
@@ -145,13 +184,9 @@ def _from_nested_schema(self, obj, field):
         }
 
     # NOTE: doubled up to maintain backwards compatibility
-    metadata = field.metadata.get('metadata', {})
-    metadata.update(field.metadata)
-
-    for md_key, md_val in metadata.items():
-        if md_key == 'metadata':
-            continue
-        schema[md_key] = md_val
+    metadata = {**field.metadata.get('metadata', {}), **field.metadata}
+    metadata.pop('metadata', None)
+    schema.update(metadata)
 
     if field.many:
         schema = {
@@ -175,40 +210,231 @@ class ViewSchema(mm.Schema):
     _exclude = mm.fields.List(mm.fields.String(), missing=list)
     _follow = mm.fields.List(mm.fields.String(), missing=list)
 
+    @mm.pre_load
+    def wrap_strings(self, data):
+        # A single field name can be given in place of a list
+        return {key: [value] if key in _VIEW_KEYS and isinstance(value, str) else value for key, value in data.items()}
+
     def build_exclude(self, original):
         schema = self.context.get('_exclude_rels', None)
+        exclude = list(_as_tuple(original.get('_exclude')) or ())
         if schema:
-            only = original.get('_only', [])
-            exclude = original.get('_exclude', [])
-            follow = original.get('_follow', [])
+            only = _as_tuple(original.get('_only')) or ()
+            follow = _as_tuple(original.get('_follow')) or ()
 
-            for key, field in schema._declared_fields.items():
-                if key not in exclude and isinstance(field, mm.fields.Nested) and hasattr(field, 'related_class'):
-                    if key in only or key in follow or key in original:
-                        continue
-                    else:
-                        exclude.append(key)
-            return exclude
+            requested = set(exclude).union(only, follow, original)
+            exclude.extend(key for key in _rel_fields(schema) if key not in requested)
 
-        orig = original.get('_exclude', [])
-        return [orig] if isinstance(orig, str) else orig
+        return exclude
 
     @mm.post_load(pass_original=True)
     def final(self, data, original):
-        data = dict(data)
-        original = dict(original)
+        # data is a fresh dict from marshmallow, so it can be reused as the context
         exclude = self.build_exclude(original)
         data.pop('_exclude', None)
+        only = data.pop('_only')
 
-        result = {
-            'only': data.pop('_only'),
-            'exclude': exclude,
-            'context': {
-                **data,
-                **{k: v for k, v in original.items() if k not in ('_only', '_exclude') and k not in data}
-            }
-        }
-        return result
+        for key, value in original.items():
+            if key not in ('_only', '_exclude') and key not in data:
+                data[key] = value
+
+        return {'only': only, 'exclude': exclude, 'context': data}
+
+
+_VIEW_KEYS = ('_only', '_exclude', '_follow')
+
+
+def _is_relationship_field(field):
+    """Return True if field was created for a relationship. Doesn't check the class itself, so that fields created
+    before this module was reloaded still match."""
+    return isinstance(field, mm.fields.Nested) and hasattr(field, 'related_class')
+
+
+def _rel_fields(schema_cls):
+    """Return the names of the relationship fields on a schema class."""
+    try:
+        return schema_cls.__dict__['__rel_fields__']
+    except KeyError:
+        rel_fields = tuple(key for key, field in schema_cls._declared_fields.items() if _is_relationship_field(field))
+        schema_cls.__rel_fields__ = rel_fields
+        return rel_fields
+
+
+_NO_VIEW_PARAMS = {'only': None, 'exclude': (), 'context': {'_follow': []}}
+
+
+def _default_params(schema_cls):
+    """Return the schema parameters used when no view arguments are given, which exclude every relationship. The
+    result is shared and must not be modified."""
+    try:
+        return schema_cls.__dict__['__default_params__']
+    except KeyError:
+        params = {'only': None, 'exclude': _rel_fields(schema_cls), 'context': {'_follow': []}}
+        schema_cls.__default_params__ = params
+        return params
+
+
+def _as_tuple(value):
+    """Normalize a view argument (None, a string, or a list of strings) into a hashable tuple."""
+    if value is None:
+        return None
+    elif isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compute_view_params(schema_cls, only, exclude, follow, extras):
+    """Compute the schema parameters for a set of view arguments, the same way that ViewSchema does. Only the names of
+    the extra (context) arguments affect the result, so the caller is responsible for filling in their values."""
+    exclude = list(exclude)
+    if schema_cls is not None:
+        requested = set(exclude).union(only or (), follow, extras)
+        exclude.extend(key for key in _rel_fields(schema_cls) if key not in requested)
+
+    return {
+        'only': only,
+        'exclude': tuple(exclude),
+        'follow': follow
+    }
+
+
+def _view_params(schema_cls, kwargs):
+    """Return the schema parameters for a set of view arguments. If schema_cls is given, relationships that are not
+    explicitly requested are excluded."""
+    if not kwargs:
+        params = _default_params(schema_cls) if schema_cls is not None else _NO_VIEW_PARAMS
+        return {'only': None, 'exclude': list(params['exclude']), 'context': {'_follow': []}}
+
+    extras = {key: value for key, value in kwargs.items() if key not in _VIEW_KEYS}
+    params = _compute_view_params(
+        schema_cls,
+        _as_tuple(kwargs.get('_only')),
+        _as_tuple(kwargs.get('_exclude', ())),
+        _as_tuple(kwargs.get('_follow', ())),
+        tuple(extras)
+    )
+
+    return {
+        'only': list(params['only']) if params['only'] is not None else None,
+        'exclude': list(params['exclude']),
+        'context': {'_follow': list(params['follow']), **extras}
+    }
+
+
+def _dump_params(schema_cls, args, kwargs):
+    """Return the schema parameters for the arguments given to to_json() or to_json_many()."""
+    if len(args) == 1 and isinstance(args[0], dict):
+        return args[0]
+    elif args:
+        raise ValueError(f'Only valid arg is a dict, got {args}')
+    elif kwargs:
+        return _view_params(schema_cls, kwargs)
+    else:
+        return _default_params(schema_cls)
+
+
+########################################################################################################################
+
+
+_SCHEMA_CACHE_SIZE = 256
+_schema_cache = threading.local()
+
+
+def _freeze(value):
+    """Convert a value built from dicts and lists into a hashable equivalent."""
+    if isinstance(value, dict):
+        return frozenset((key, _freeze(val)) for key, val in value.items())
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(val) for val in value)
+    return value
+
+
+def _copy_containers(value):
+    """Copy the dicts and lists in a value, leaving everything else as-is."""
+    if isinstance(value, dict):
+        return {key: _copy_containers(val) for key, val in value.items()}
+    elif isinstance(value, list):
+        return [_copy_containers(val) for val in value]
+    return value
+
+
+def _is_view_context(context):
+    """Return True if a context holds nothing but view arguments, directly or in the nested dicts for related
+    fields."""
+    for key, value in context.items():
+        if isinstance(value, dict):
+            if not _is_view_context(value):
+                return False
+        elif key not in _VIEW_KEYS or not _is_field_names(value):
+            return False
+
+    return True
+
+
+def _is_field_names(value):
+    """Return True if value is None, a field name, or a list or tuple of field names."""
+    if value is None or isinstance(value, str):
+        return True
+    return isinstance(value, (list, tuple)) and all(isinstance(name, str) for name in value)
+
+
+def _is_view_params(params):
+    """Return True if a set of schema parameters holds nothing but view arguments, which makes it safe to use as a
+    cache key."""
+    return params.keys() <= {'only', 'exclude', 'context'} and _is_field_names(params.get('only')) and \
+        _is_field_names(params.get('exclude')) and _is_view_context(params.get('context', {}))
+
+
+def _get_schema_instance(schema_cls, params=None):
+    """Return an instance of schema_cls for the given parameters. Instances are cached when the parameters are plain
+    view arguments, so that a context holding arbitrary objects is never shared or kept alive by the cache.
+
+    RelationshipField sets only, exclude and context on its nested schema while dumping, so cached instances are kept
+    per thread. Callers must not change them otherwise."""
+    params = params or {}
+    if not _is_view_params(params):
+        return schema_cls(**params)
+
+    try:
+        instances = _schema_cache.instances
+    except AttributeError:
+        instances = _schema_cache.instances = collections.OrderedDict()
+
+    key = (schema_cls, _freeze(params))
+    try:
+        instances.move_to_end(key)
+        return instances[key]
+    except KeyError:
+        pass
+
+    schema = instances[key] = schema_cls(**_copy_containers(params))
+    if len(instances) > _SCHEMA_CACHE_SIZE:
+        instances.popitem(last=False)
+
+    return schema
+
+
+_json_schemas = collections.OrderedDict()
+
+
+def _get_json_schema(schema_cls, params):
+    """Return the JSON schema for schema_cls with the given parameters. Results are cached until another model is
+    declared, and each caller gets its own copy."""
+    key = (schema_cls, _freeze(params)) if _is_view_params(params) else None
+    if key in _json_schemas:
+        _json_schemas.move_to_end(key)
+        return _copy_containers(_json_schemas[key])
+
+    schema = _get_schema_instance(schema_cls, params)
+    js_schema = fix_refs(mmjs.JSONSchema(context=params['context']).dump(schema).data)
+
+    if key is not None:
+        _json_schemas[key] = js_schema
+        if len(_json_schemas) > _SCHEMA_CACHE_SIZE:
+            _json_schemas.popitem(last=False)
+
+    return _copy_containers(js_schema)
 
 
 ########################################################################################################################
@@ -218,17 +444,42 @@ def column_default(col):
     """Return the default value for a column."""
     if col.default:
         if col.default.is_callable:
-            return lambda: col.default.arg({})
+            arg = col.default.arg
+            return lambda: arg({})
         else:
             return col.default.arg
 
 
+_tablename_indexes = weakref.WeakKeyDictionary()
+
+
+def _tablename_index(base):
+    """Return a dict mapping table names to the classes registered with a declarative base. Subclasses that inherit
+    their parent's table don't replace it. The index is built once per base and kept up to date by JsonMetaMixin."""
+    index = _tablename_indexes.get(base)
+    if index is None:
+        index = {}
+        for c in base._decl_class_registry.values():
+            if hasattr(c, '__tablename__'):
+                index.setdefault(c.__tablename__, c)
+        _tablename_indexes[base] = index
+
+    return index
+
+
+def _declarative_base(cls):
+    """Return the declarative base of a model class."""
+    try:
+        return cls.__dict__['__declarative_base__']
+    except KeyError:
+        base = get_declarative_base(cls)
+        cls.__declarative_base__ = base
+        return base
+
+
 def get_class_from_tablename(base, table):
     """Return the class mapped to a particular table name, or None."""
-    for c in base._decl_class_registry.values():
-        if hasattr(c, '__tablename__') and c.__tablename__ == table:
-            return c
-    return None
+    return _tablename_index(base).get(table, None)
 
 
 def _column_to_field(cls, col, name, opts):
@@ -242,34 +493,40 @@ def _column_to_field(cls, col, name, opts):
     else:
         field_type = FIELD_MAP.get(col.type.python_type, mm.fields.Raw)
 
-    if isinstance(field_type, (mm.fields.Field, type(None))):
+    if field_type is None or isinstance(field_type, mm.fields.Field):
         return field_type
 
     options = {
         'required': not bool(col.nullable),
         'allow_none': bool(col.nullable),
         'dump_only': bool(col.primary_key),
-        'missing': column_default(col)
+        'missing': column_default(col),
+        **opts,
+        **info
     }
 
-    options.update(opts)
-    options.update(info)
-
     field = field_type(**options)
 
-    foreign_keys = list(col.foreign_keys)
-    if len(foreign_keys) == 1:
-        fkey = foreign_keys[0]
-        table_name = fkey.target_fullname.split('.')[0]
-        decl_base = get_declarative_base(cls)
+    num_foreign_keys = len(col.foreign_keys)
+    if num_foreign_keys == 1:
+        fkey = next(iter(col.foreign_keys))
+        table_name = fkey.target_fullname.rsplit('.', 2)[-2]
+        decl_base = _declarative_base(cls)
+
+        class_name = None
 
         def foreign_class():
-            class_ = get_class_from_tablename(decl_base, table_name)
-            return class_.__name__ if class_ else 'unknown'
+            nonlocal class_name
+            if class_name is None:
+                class_ = get_class_from_tablename(decl_base, table_name)
+                if class_ is None:
+                    return 'unknown'
+                class_name = class_.__name__
+            return class_name
 
         field.foreign_class = foreign_class
 
-    elif len(foreign_keys) > 1:
+    elif num_foreign_keys > 1:
         raise ValueError('Multiple foreign keys are not supported.')
 
     return field
@@ -279,16 +536,15 @@ def _hybrid_to_field(cls, hybrid, name, opts):
     """Create a Field from a SQLAlchemy hybrid property."""
     info = hybrid.info
     field_type = info.pop('field', None) or opts.pop('field', None) or mm.fields.Raw
-    if isinstance(field_type, (type(None), mm.fields.Field)):
+    if field_type is None or isinstance(field_type, mm.fields.Field):
         return field_type
 
     options = {
-        'dump_only': hybrid.fset is None
+        'dump_only': hybrid.fset is None,
+        **opts,
+        **info
     }
 
-    options.update(opts)
-    options.update(info)
-
     return field_type(**options)
 
 
@@ -296,40 +552,80 @@ def _prop_to_field(cls, prop, name, opts):
     """Create a field from a jb_property."""
     info = prop.info
     field_type = info.pop('field', None) or opts.pop('field', None) or mm.fields.Raw
-    if isinstance(field_type, (type(None), mm.fields.Field)):
+    if field_type is None or isinstance(field_type, mm.fields.Field):
         return field_type
 
     options = {
-        'dump_only': prop.setter is None
+        'dump_only': prop.setter is None,
+        **opts,
+        **info
     }
 
-    options.update(opts)
-    options.update(info)
-
     return field_type(**options)
 
 
-def _serialize_relationship(self, value, attr, obj):
-    """Patches mm.fields.Nested's _serialize method. Used on Nested fields that correspond to SQLAlchemy relationships.
-    """
-    if isinstance(value, sa.orm.Query):
-        value = value.all()
+_LAZY_STRATEGIES = ('select', True, 'dynamic')
+
+
+def _prefetch_options(loader, query, schema_cls, params):
+    """Return loader options that eagerly load the relationships of a query's results that will be serialized."""
+    relationships = sa.inspect(query.column_descriptions[0]['entity']).relationships
+    only = params['only']
+    exclude = set(params['exclude'])
+
+    return [
+        loader(relationships[name].class_attribute) for name in _rel_fields(schema_cls)
+        if name in relationships and name not in exclude and (only is None or name in only)
+    ]
+
 
-    attr_ctx = self.context.get(attr, {})
-    related_class = mm.class_registry.get_class(self.related_class)
-    params = ViewSchema(context={'_exclude_rels': related_class}).load(attr_ctx).data
-    self.only = params['only']
-    self.exclude = params['exclude']
-    self.schema.context = attr_ctx
+class RelationshipField(mm.fields.Nested):
+    """A Nested field that corresponds to a SQLAlchemy relationship."""
 
-    return mm.fields.Nested._serialize(self, value, attr, obj)
+    def __init__(self, nested, prefetch=None, warn_lazy=False, **kwargs):
+        super().__init__(nested, **kwargs)
+        self.related_class = nested
+        self.prefetch = prefetch
+        self.warn_lazy = warn_lazy
 
+    def _serialize(self, value, attr, obj):
+        if value is None:
+            return None
+        elif self.many and isinstance(value, (list, tuple, set)) and not value:
+            return []
 
-def _deepcopy_patch(self, memo):
-    """Patches __deepcopy__ on Nested fields."""
-    new = super(mm.fields.Nested, self).__deepcopy__(memo)
-    new._serialize = types.MethodType(_serialize_relationship, new)
-    return new
+        attr_ctx = self.context.get(attr, {})
+        related_class = self.nested
+        if isinstance(related_class, str):
+            related_class = self.nested = mm.class_registry.get_class(self.related_class)
+        params = _view_params(related_class, attr_ctx) if attr_ctx else _default_params(related_class)
+
+        if isinstance(value, sa.orm.Query):
+            if self.prefetch is not None:
+                value = value.options(*_prefetch_options(self.prefetch, value, related_class, params))
+            value = value.all()
+
+        self.only = params['only']
+        self.exclude = params['exclude']
+        self.schema.context = attr_ctx
+
+        return super()._serialize(value, attr, obj)
+
+    def get_value(self, attr, obj, accessor=None):
+        """If the field was created with warn_lazy, warns when getting the value will lazy-load the relationship, since
+        doing that for each of several objects issues one query per object."""
+        if self.warn_lazy:
+            state = sa.inspect(obj, raiseerr=False)
+            key = getattr(self, 'attribute', None) or attr
+
+            if state is not None and state.has_identity and key in state.unloaded:
+                rel = state.mapper.relationships.get(key)
+                if rel is not None and rel.lazy in _LAZY_STRATEGIES:
+                    warnings.warn(f'Lazy-loading {state.class_.__name__}.{key} during serialization. When serializing '
+                                  f'several objects, this issues one query per object; consider eager loading the '
+                                  f'relationship.')
+
+        return super().get_value(attr, obj, accessor)
 
 
 def _relationship_to_field(cls, rel, name, opts):
@@ -340,13 +636,14 @@ def _relationship_to_field(cls, rel, name, opts):
     if rel.uselist:
         options.update(many=True)
 
-    rel_class = rel.argument.arg
-    field = mm.fields.Nested(rel_class, **options)  # Schema has the same name as the class
-    field.related_class = rel_class
-    field._serialize = types.MethodType(_serialize_relationship, field)
-    field.__deepcopy__ = types.MethodType(_deepcopy_patch, field)
+    prefetch = options.pop('prefetch', None)
+    if isinstance(prefetch, str):
+        prefetch = getattr(sa.orm, prefetch)
 
-    return field
+    warn_lazy = options.pop('warn_lazy', False)
+
+    # Schema has the same name as the class
+    return RelationshipField(rel.argument.arg, prefetch=prefetch, warn_lazy=warn_lazy, **options)
 
 
 ########################################################################################################################
@@ -374,27 +671,32 @@ FIELD_MAP = {
 
 def _make_field(cls, attr, name, opts):
     """Create a Field for a given attribute."""
-    field_opts = {k: v for k, v in opts.items() if k != 'field'} if isinstance(opts, dict) else {}
+    field_opts = {}
+
+    # Most attributes have no schema args, so check for that first
+    if type(opts) is dict and not opts:
+        field_type = FIELD_MAP.get(type(attr), None)
 
     # Shortcut cases where opts is None, an instance of a Field, or a Field subclass
-    if opts is None:
+    elif opts is None:
         return None
 
     elif isinstance(opts, mm.fields.Field):
         return opts
 
-    elif inspect.isclass(opts) and issubclass(opts, mm.fields.Field):
+    elif isinstance(opts, type) and issubclass(opts, mm.fields.Field):
         field_type = opts
 
-    elif 'field' in opts:
-        field_type = opts['field']
-
     else:
-        field_type = FIELD_MAP.get(type(attr), None)
+        field_opts = dict(opts)
+        if 'field' in field_opts:
+            field_type = field_opts.pop('field')
+        else:
+            field_type = FIELD_MAP.get(type(attr), None)
 
     if field_type is None:
         return None
-    elif inspect.isfunction(field_type):
+    elif isinstance(field_type, types.FunctionType):
         return field_type(cls, attr, name, field_opts)
     else:
         return field_type(**field_opts)
@@ -403,6 +705,100 @@ def _make_field(cls, attr, name, opts):
 ########################################################################################################################
 
 
+_dump_counter = itertools.count()
+
+
+def _compile_dump(model_cls, schema_cls):
+    """Generate a function that dumps an instance of model_cls the same way schema_cls does with the default view
+    params, but without marshmallow's per-field overhead. Returns None if the schema uses features that the generated
+    code can't reproduce."""
+    if hasattr(model_cls, '__getitem__'):
+        return None
+
+    schema = _get_schema_instance(schema_cls, _default_params(schema_cls))
+    if schema._has_processors or schema.ordered or schema.extra or schema.prefix or \
+            type(schema).get_attribute is not mm.Schema.get_attribute:
+        return None
+
+    # Fields listed in Meta.fields or Meta.additional take their type from each object being dumped
+    if schema.opts.fields or schema.opts.additional:
+        return None
+
+    mapper = sa.inspect(model_cls, raiseerr=False)
+    columns = set()
+    if mapper is not None:
+        columns = {key for key in mapper.column_attrs.keys() if key.isidentifier() and not keyword.iskeyword(key)}
+
+    namespace = {'MISSING': mm.missing}
+    lines = ['def dump(obj):', '    out = {}']
+
+    for index, (name, field) in enumerate(schema.fields.items()):
+        if field.load_only:
+            continue
+
+        field_cls = type(field)
+        attribute = field.attribute or name
+        if isinstance(field, mm.fields.Nested) or not field._CHECK_ATTRIBUTE or '.' in attribute or \
+                field_cls.get_value is not mm.fields.Field.get_value or \
+                field_cls.serialize is not mm.fields.Field.serialize:
+            return None
+
+        key = field.dump_to or name
+        if field_cls._serialize is mm.fields.Field._serialize:
+            result = 'value'
+        else:
+            namespace[f'serialize_{index}'] = field._serialize
+            result = f'serialize_{index}(value, {name!r}, obj)'
+
+        # Mapped columns are always present, so they can be read directly
+        if attribute in columns:
+            lines.append(f'    value = obj.{attribute}')
+            lines.append('    if callable(value):')
+            lines.append('        value = value()')
+            lines.append(f'    out[{key!r}] = {result}')
+            continue
+
+        lines.append(f'    value = getattr(obj, {attribute!r}, MISSING)')
+        lines.append('    if value is not MISSING:')
+        lines.append('        if callable(value):')
+        lines.append('            value = value()')
+        lines.append(f'        out[{key!r}] = {result}')
+
+        if field.default is not mm.missing:
+            namespace[f'default_{index}'] = field.default
+            lines.append('    else:')
+            lines.append(f'        out[{key!r}] = default_{index}{"()" if callable(field.default) else ""}')
+
+    lines.append('    return out')
+    source = '\n'.join(lines) + '\n'
+
+    # Register the source with linecache so that tracebacks can show it
+    filename = f'<jsonbase dump {model_cls.__module__}.{model_cls.__qualname__}-{next(_dump_counter)}>'
+    try:
+        exec(compile(source, filename, 'exec'), namespace)
+    except (SyntaxError, ValueError):
+        return None  # Let marshmallow dump it
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+
+    return namespace['dump']
+
+
+def _fast_dump(model_cls, schema_cls):
+    """Return the compiled dump function for a model's schema, or None if it doesn't have one."""
+    try:
+        return schema_cls.__dict__['_fast_dump']
+    except KeyError:
+        fast_dump = _compile_dump(model_cls, schema_cls)
+        schema_cls._fast_dump = fast_dump
+        return fast_dump
+
+
+########################################################################################################################
+
+
+_pending_models = weakref.WeakSet()
+
+
 class JsonMetaMixin:
     """A mixin for the database model metaclass that automatically generates a marshmallow schema when the class is
     created."""
@@ -417,6 +813,8 @@ class JsonMetaMixin:
         for attr_name, attr in dict_.items():
             if attr_name.startswith('_'):
                 continue
+            elif attr_name not in schema_args and type(attr) not in FIELD_MAP:
+                continue
 
             field_args = schema_args.get(attr_name, {})
             field = _make_field(cls, attr, attr_name, field_args)
@@ -426,6 +824,15 @@ class JsonMetaMixin:
         BaseSchema = getattr(cls, '__schema__', mm.Schema)
         cls.__schema__ = type(f'{cls.__name__}', (BaseSchema,), fields)
         cls.__schema_args__ = schema_args
+        _rel_fields(cls.__schema__)
+        _default_params(cls.__schema__)
+        _pending_models.add(cls)
+        _json_schemas.clear()
+        _nested_json_schemas.clear()
+
+        index = _tablename_indexes.get(_declarative_base(cls))
+        if index is not None and hasattr(cls, '__tablename__'):
+            index.setdefault(cls.__tablename__, cls)
 
 
 ########################################################################################################################
@@ -438,16 +845,34 @@ class JsonMixin:
         """Serialize the model."""
         schema_cls = getattr(self, _schema)
 
-        if len(args) == 1 and isinstance(args[0], dict):
-            params = args[0]
-        elif args:
-            raise ValueError(f'Only valid arg is a dict, got {args}')
-        else:
-            params = ViewSchema(context={'_exclude_rels': schema_cls}).load(kwargs).data
+        if not args and not kwargs and _schema == '__schema__':
+            fast_dump = _fast_dump(type(self), schema_cls)
+            if fast_dump is not None:
+                try:
+                    return fast_dump(self)
+                except mm.ValidationError:
+                    pass  # Let marshmallow collect the errors
 
-        schema = schema_cls(**params)
+        schema = _get_schema_instance(schema_cls, _dump_params(schema_cls, args, kwargs))
         return schema.dump(self).data
 
+    @classmethod
+    def to_json_many(cls, objs, *args, _schema='__schema__', **kwargs):
+        """Serialize a list of models using the class's schema. Prefer this to calling to_json() on each object."""
+        schema_cls = getattr(cls, _schema)
+        objs = list(objs)  # The fast path may have to start over
+
+        if not args and not kwargs and _schema == '__schema__':
+            fast_dump = _fast_dump(cls, schema_cls)
+            if fast_dump is not None:
+                try:
+                    return [fast_dump(obj) for obj in objs]
+                except mm.ValidationError:
+                    pass  # Let marshmallow collect the errors
+
+        schema = _get_schema_instance(schema_cls, _dump_params(schema_cls, args, kwargs))
+        return schema.dump(objs, many=True).data
+
     @classmethod
     def json_schema(cls, *args, _schema='__schema__', **kwargs):
         """Return a JSON schema for the model's schema."""
@@ -457,16 +882,17 @@ class JsonMixin:
             params = args[0]
         elif args:
             raise ValueError(f'Only valid arg is a dict, got {args}')
+        elif kwargs:
+            params = _view_params(None, kwargs)
         else:
-            params = ViewSchema().load(kwargs).data
+            params = _NO_VIEW_PARAMS
 
-        js_schema = mmjs.JSONSchema(context=params['context']).dump(schema_cls(**params)).data
-        return fix_refs(js_schema)
+        return _get_json_schema(schema_cls, params)
 
     @classmethod
     def validate(cls, data, partial=False):
         """Validate data against the classes' schema."""
-        schema = cls.__schema__()
+        schema = _get_schema_instance(cls.__schema__)
         return schema.validate(data, partial=partial)
 
     @classmethod
@@ -478,17 +904,17 @@ class JsonMixin:
 
     def update(self, *args, **kwargs):
         """Update a model's attributes using a JSON document."""
-        if len(args) == 1:
-            if isinstance(args[0], collections.Mapping):
+        if not args:
+            data = kwargs
+        elif len(args) == 1:
+            if type(args[0]) is dict or isinstance(args[0], Mapping):
                 data = args[0]
             else:
-                raise TypeError('Argument must be an instance of collections.Mapping')
-        elif len(args) > 1:
-            raise ValueError('update() can only accept a single key-value mapping as a positional argument.')
+                raise TypeError('Argument must be an instance of collections.abc.Mapping')
         else:
-            data = kwargs
+            raise ValueError('update() can only accept a single key-value mapping as a positional argument.')
 
-        loaded = self.__schema__().load(data, partial=True).data
+        loaded = _get_schema_instance(self.__schema__).load(data, partial=True).data
         extra = {k: v for k, v in data.items() if k not in loaded}
 
         for key, value in loaded.items():
@@ -510,19 +936,27 @@ JsonBase = declarative_base(cls=JsonMixin, metaclass=JsonBaseMeta)
 ########################################################################################################################
 
 
-def _annotate_info(fn, *args, **kwargs):
-    """Shortcut method for declaring columns with schema annotations."""
-    field_keys = ('label', 'format', 'missing', 'validate', 'field')
-    field_kwargs = {key: kwargs.pop(key) for key in field_keys if key in kwargs}
+@sa.event.listens_for(sa.orm.mapper, 'after_configured')
+def _resolve_relationships():
+    """Once all mappers are configured, point each new model's relationship fields directly at their related schemas,
+    so that the class registry isn't searched every time the field is serialized."""
+    while _pending_models:
+        schema_cls = _pending_models.pop().__schema__
+        for name in _rel_fields(schema_cls):
+            field = schema_cls._declared_fields[name]
+            if isinstance(field.nested, str):
+                try:
+                    field.nested = mm.class_registry.get_class(field.nested)
+                except mm.exceptions.RegistryError:
+                    pass
 
-    if 'label' in field_kwargs:
-        field_kwargs['title'] = field_kwargs.pop('label')
 
-    info = {
-        **kwargs.pop('info', {}),
-        **field_kwargs,
-    }
+########################################################################################################################
+
 
+def _annotate_info(fn, *args, **kwargs):
+    """Shortcut method for declaring columns with schema annotations."""
+    info = _field_info(kwargs)
     return fn(*args, info=info, **kwargs)
 
 
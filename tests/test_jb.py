@@ -1,8 +1,19 @@
+import gc
 import pytest
+import weakref
+import importlib
+import warnings
+import decimal as dec
+import datetime as dt
 import sqlalchemy as sa
 import marshmallow as mm
+import marshmallow_jsonschema as mmjs
 
-from jb.jb import Base, column_default, _column_to_field, ViewSchema
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy_jsonbase import jb
+from sqlalchemy_jsonbase.jb import JsonBase as Base, JsonMixin, JsonBaseMeta, column_default, _column_to_field, \
+    ViewSchema, jb_property, _fast_dump, _default_params
 from unittest.mock import Mock
 
 
@@ -29,6 +40,130 @@ class Model(Base):
     }
 
 
+class Dumped(Base):
+    """A model whose default dump is compiled."""
+    __tablename__ = 'dumped'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String)
+    amount = sa.Column(sa.Numeric, default=5)
+    created = sa.Column(sa.DateTime)
+    nickname = sa.Column(sa.String, info={'attribute': 'name'})
+    title = sa.Column(sa.String, info={'dump_to': 'Title'})
+
+    @hybrid_property
+    def upper(self):
+        return self.name.upper() if self.name else None
+
+    @jb_property
+    def maybe(self):
+        raise AttributeError('maybe')
+
+    __schema_args__ = {
+        'maybe': {'default': 'fallback'}
+    }
+
+
+class Keyworded(Base):
+    """A model with a column named after a Python keyword."""
+    __tablename__ = 'keyworded'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    locals()['from'] = sa.Column(sa.String)
+
+
+class Flagged(Base):
+    """A model with a field that reads the serialization context."""
+    __tablename__ = 'flagged'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    flag = None
+
+    __schema_args__ = {
+        'flag': mm.fields.Function(lambda obj, ctx: str(ctx['flag']))
+    }
+
+
+class StampSchema(mm.Schema):
+    """A base schema that adds an undeclared field."""
+
+    class Meta:
+        additional = ('stamp',)
+
+
+class Stamped(Base):
+    """A model whose schema infers a field's type from the object."""
+    __tablename__ = 'stamped'
+    __schema__ = StampSchema
+
+    id = sa.Column(sa.Integer, primary_key=True)
+
+    @property
+    def stamp(self):
+        return dt.datetime(2020, 1, 2)
+
+
+class Author(Base):
+    """A model with a collection of related models."""
+    __tablename__ = 'author'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String)
+    books = sa.orm.relationship('Book', lazy='dynamic', uselist=True, info={'prefetch': 'selectinload'})
+    plain_books = sa.orm.relationship('Book', lazy='dynamic', uselist=True, viewonly=True)
+
+
+class Book(Base):
+    """A model with relationships in both directions."""
+    __tablename__ = 'book'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    title = sa.Column(sa.String)
+    author_id = sa.Column(sa.Integer, sa.ForeignKey('author.id'))
+    author = sa.orm.relationship('Author')
+    reviews = sa.orm.relationship('Review', uselist=True)
+
+
+class Review(Base):
+    """A model with a relationship that warns when it is lazy-loaded."""
+    __tablename__ = 'review'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    stars = sa.Column(sa.Integer)
+    book_id = sa.Column(sa.Integer, sa.ForeignKey('book.id'))
+    book = sa.orm.relationship('Book', info={'warn_lazy': True})
+
+
+class Pinned(Base):
+    """A model with a relationship that overrides its JSON schema."""
+    __tablename__ = 'pinned'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    author_id = sa.Column(sa.Integer, sa.ForeignKey('author.id'))
+    author = sa.orm.relationship('Author', info={'_jsonschema_type_mapping': {'type': 'custom'}})
+
+
+# Models in other database schemas, which the in-memory test database can't create
+OtherBase = declarative_base(cls=JsonMixin, metaclass=JsonBaseMeta)
+
+
+class Shelf(OtherBase):
+    """A model in a named database schema."""
+    __tablename__ = 'shelf'
+    __table_args__ = {'schema': 'store'}
+
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+class Item(OtherBase):
+    """A model with a schema-qualified foreign key."""
+    __tablename__ = 'item'
+    __table_args__ = {'schema': 'store'}
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    shelf_id = sa.Column(sa.Integer, sa.ForeignKey('store.shelf.id'))
+
+
 ########################################################################################################################
 # Fixtures
 
@@ -47,6 +182,50 @@ def session(engine):
     return Session()
 
 
+@pytest.fixture(scope='function')
+def library(session):
+    """Adds an author with a few reviewed books to the database."""
+    author = Author(name='Author')
+    for index in range(3):
+        book = Book(title=f'Book {index}', author=author)
+        book.reviews = [Review(stars=stars) for stars in (3, 5)]
+        session.add(book)
+
+    session.commit()
+    session.expire_all()
+    yield author
+
+    for model in (Review, Book, Author):
+        session.query(model).delete()
+    session.commit()
+
+
+@pytest.fixture(scope='function')
+def statements(engine):
+    """Records the SQL statements executed during the test."""
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    sa.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    sa.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture(scope='function')
+def reloaded_jb():
+    """Reloads the jb module for the test, then puts back the original module contents."""
+    saved = dict(jb.__dict__)
+    importlib.reload(jb)
+    yield jb
+
+    sa.event.remove(sa.orm.mapper, 'after_configured', jb._resolve_relationships)
+    mmjs.JSONSchema._get_schema_for_field = saved['_get_schema_for_field']
+    mmjs.JSONSchema._from_nested_schema = saved['_from_nested_schema']
+    jb.__dict__.update(saved)
+
+
 ########################################################################################################################
 # Tests
 
@@ -58,7 +237,7 @@ def session(engine):
     ({'_exclude': ['one', 'two'], '_follow': 'three'}, {'only': None, 'exclude': ['one', 'two'], 'context': {'_follow': ['three']}}),
 ])
 def test_view_schema(kwargs, expected):
-    results = ViewSchema().dump(kwargs).data
+    results = ViewSchema().load(kwargs).data
     assert results == expected
 
 
@@ -79,6 +258,15 @@ def test_column_default_func():
     assert func() == 5
 
 
+def test_column_default_func_gets_fresh_context():
+    def count_calls(context):
+        context['calls'] = context.get('calls', 0) + 1
+        return context['calls']
+
+    func = column_default(sa.Column(sa.Integer, default=count_calls))
+    assert [func(), func()] == [1, 1]
+
+
 @pytest.mark.parametrize('name,col', [
     ('foo', sa.Column(sa.Integer)),
     ('two', sa.Column(sa.String, nullable=False)),
@@ -87,7 +275,7 @@ def test_column_default_func():
     ('five', sa.Column(sa.String, default=lambda: 'world'))
 ])
 def test_column_to_field(name, col):
-    field = _column_to_field(name, col, {})
+    field = _column_to_field(Model, col, name, {})
 
     assert field.required != col.nullable
     assert field.allow_none == col.nullable
@@ -107,7 +295,7 @@ def test_column_to_field(name, col):
     (sa.Column(sa.Integer), {'required': True}),
 ])
 def test_column_to_field_custom_opts(col, opts):
-    field = _column_to_field('name', col, opts)
+    field = _column_to_field(Model, col, 'name', opts)
 
     if 'field' in opts:
         custom_field = opts.get('field', None)
@@ -141,6 +329,232 @@ def test_column_to_field_custom_opts(col, opts):
 ])
 def test_column_to_field_custom_info(col):
     info = dict(col.info)
+    field = _column_to_field(Model, col, 'name', {})
 
     if 'field' in info:
-        custom_field = g
+        custom_field = info['field']
+        if custom_field is None:
+            assert field is None
+            return
+        elif isinstance(custom_field, mm.fields.Field):
+            assert field is custom_field
+            return
+        elif issubclass(custom_field, mm.fields.Field):
+            assert isinstance(field, custom_field)
+
+    for key, value in info.items():
+        if key == 'required':
+            assert field.required == value
+        elif key != 'field':
+            assert field.metadata[key] == value
+
+
+def _schema_dump(obj):
+    """Dump an object using marshmallow and the default view params."""
+    schema_cls = type(obj).__schema__
+    return schema_cls(**_default_params(schema_cls)).dump(obj).data
+
+
+@pytest.mark.parametrize('obj', [
+    Dumped(),
+    Dumped(id=1, name='one', amount=dec.Decimal('1.50'), created=dt.datetime(2020, 1, 2, 3, 4, 5), title='First'),
+    Dumped(id=2, name='', amount=0, title=''),
+])
+def test_fast_dump_matches_schema(obj):
+    fast_dump = _fast_dump(Dumped, Dumped.__schema__)
+    assert fast_dump is not None
+
+    expected = _schema_dump(obj)
+    assert fast_dump(obj) == expected
+    assert obj.to_json() == expected
+
+
+def test_fast_dump_renamed_and_default_fields():
+    result = _fast_dump(Dumped, Dumped.__schema__)(Dumped(name='one', title='First'))
+
+    assert result['nickname'] == 'one'
+    assert result['Title'] == 'First'
+    assert 'title' not in result
+    assert result['maybe'] == 'fallback'
+    assert result['upper'] == 'ONE'
+
+
+def test_fast_dump_validation_error_falls_back():
+    obj = Dumped(id='not a number', name='one')
+
+    with pytest.raises(mm.ValidationError):
+        _fast_dump(Dumped, Dumped.__schema__)(obj)
+
+    assert obj.to_json() == _schema_dump(obj)
+
+
+def test_fast_dump_skips_inferred_fields():
+    obj = Stamped(id=1)
+
+    assert _fast_dump(Stamped, Stamped.__schema__) is None
+    assert obj.to_json() == {'id': 1, 'stamp': '2020-01-02T00:00:00+00:00'}
+    assert Stamped.to_json_many([obj]) == [obj.to_json()]
+
+
+def test_fast_dump_keyword_column():
+    obj = Keyworded(id=1)
+    setattr(obj, 'from', 'x')
+
+    assert _fast_dump(Keyworded, Keyworded.__schema__) is not None
+    assert obj.to_json() == {'id': 1, 'from': 'x'}
+
+
+def test_to_json_context_values_are_not_conflated():
+    obj = Flagged(id=1)
+    assert [obj.to_json(flag=value)['flag'] for value in (True, 1, 1.0)] == ['True', '1', '1.0']
+
+
+def test_to_json_context_is_not_kept_alive():
+    class Token:
+        def __str__(self):
+            return 'token'
+
+    token = Token()
+    token_ref = weakref.ref(token)
+    assert Flagged(id=1).to_json(flag=token)['flag'] == 'token'
+
+    del token
+    gc.collect()
+    assert token_ref() is None
+
+
+def test_lazy_load_does_not_warn_by_default(session, library):
+    book = session.query(Book).first()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert book.to_json(_follow=['author'])['author']['name'] == 'Author'
+
+
+def test_lazy_load_warns_when_enabled(session, library):
+    review = session.query(Review).first()
+
+    with pytest.warns(UserWarning, match='Lazy-loading Review.book'):
+        assert review.to_json(_follow=['book'])['book']['title'] == 'Book 0'
+
+
+def test_to_json_many_fast_path():
+    objs = [Dumped(id=1, name='one'), Dumped(id=2, name='two', title='Second')]
+    assert Dumped.to_json_many(objs) == [obj.to_json() for obj in objs]
+
+
+def test_to_json_many_view_args():
+    objs = [Dumped(id=1, name='one'), Dumped(id=2, name='two')]
+    assert Dumped.to_json_many(objs, _only=['id', 'upper']) == [{'id': 1, 'upper': 'ONE'}, {'id': 2, 'upper': 'TWO'}]
+
+
+@pytest.mark.parametrize('wrap', [list, iter])
+def test_to_json_many_validation_error_falls_back(wrap):
+    objs = [Dumped(id=1, name='one'), Dumped(id='not a number', name='bad'), Dumped(id=3, name='three')]
+    expected = Dumped.__schema__(**_default_params(Dumped.__schema__)).dump(objs, many=True).data
+
+    result = Dumped.to_json_many(wrap(objs))
+    assert len(result) == 3
+    assert result == expected
+
+
+def test_prefetch_is_not_field_metadata():
+    field = Author.__schema__._declared_fields['books']
+    assert field.prefetch is sa.orm.selectinload
+    assert 'prefetch' not in field.metadata
+
+
+def test_prefetch_reduces_queries(session, library, statements):
+    author = session.query(Author).one()
+    del statements[:]
+    plain = author.to_json(_follow=['plain_books'], plain_books={'_follow': ['reviews']})['plain_books']
+    assert len(statements) == 4  # The books, then the reviews for each book
+
+    session.expire_all()
+    author = session.query(Author).one()
+    del statements[:]
+    prefetched = author.to_json(_follow=['books'], books={'_follow': ['reviews']})['books']
+    assert len(statements) == 2  # The books, then the reviews for all of them
+
+    assert prefetched == plain
+    assert len(prefetched) == 3
+    assert all(len(book['reviews']) == 2 for book in prefetched)
+
+
+def test_json_schema_relationship_not_followed():
+    js_schema = Book.json_schema()
+    properties = js_schema['definitions']['Book']['properties']
+
+    assert properties['author'] == {'$ref': 'Author#/definitions/Author', 'type': 'object'}
+    assert properties['reviews']['items']['$ref'] == 'Review#/definitions/Review'
+    assert properties['author_id']['idtype'] == 'Author'
+    assert set(js_schema['definitions']) == {'Book'}
+
+
+def test_json_schema_relationship_followed():
+    js_schema = Book.json_schema(_follow=['author'])
+    properties = js_schema['definitions']['Book']['properties']
+
+    assert properties['author'] == {'$ref': '#/definitions/Author', 'type': 'object'}
+    assert properties['reviews']['items']['$ref'] == 'Review#/definitions/Review'
+    assert set(js_schema['definitions']) == {'Book', 'Author'}
+    assert 'name' in js_schema['definitions']['Author']['properties']
+
+
+def test_json_schema_relationship_type_mapping():
+    properties = Pinned.json_schema()['definitions']['Pinned']['properties']
+    assert properties['author'] == {'type': 'custom'}
+
+
+def test_json_schema_after_reload(reloaded_jb):
+    assert mmjs.JSONSchema._get_schema_for_field is reloaded_jb._get_schema_for_field
+    assert reloaded_jb.old_get_schema.__module__ == 'marshmallow_jsonschema.base'
+
+    properties = Book.json_schema()['definitions']['Book']['properties']
+    assert properties['author'] == {'$ref': 'Author#/definitions/Author', 'type': 'object'}
+    assert properties['reviews']['items']['$ref'] == 'Review#/definitions/Review'
+
+
+def test_json_schema_schema_qualified_foreign_key():
+    properties = Item.json_schema()['definitions']['Item']['properties']
+    assert properties['shelf_id']['idtype'] == 'Shelf'
+
+
+def test_json_schema_refreshes_when_a_model_is_declared():
+    class Placard(OtherBase):
+        __tablename__ = 'placard'
+
+        id = sa.Column(sa.Integer, primary_key=True)
+        late_id = sa.Column(sa.Integer, sa.ForeignKey('late.id'))
+
+    class Holder(OtherBase):
+        __tablename__ = 'holder'
+
+        id = sa.Column(sa.Integer, primary_key=True)
+        placard_id = sa.Column(sa.Integer, sa.ForeignKey('placard.id'))
+        placard = sa.orm.relationship('Placard')
+
+    def idtypes():
+        own = Placard.json_schema()['definitions']['Placard']['properties']['late_id']
+        nested = Holder.json_schema(_follow=['placard'])['definitions']['Placard']['properties']['late_id']
+        return own['idtype'], nested['idtype']
+
+    assert idtypes() == ('unknown', 'unknown')
+
+    # Each call returns its own copy of the cached result
+    Placard.json_schema()['definitions']['Placard']['properties']['late_id']['idtype'] = 'changed'
+    Holder.json_schema(_follow=['placard'])['definitions']['Placard']['properties']['late_id']['idtype'] = 'changed'
+    assert idtypes() == ('unknown', 'unknown')
+
+    class Late(OtherBase):
+        __tablename__ = 'late'
+
+        id = sa.Column(sa.Integer, primary_key=True)
+
+    assert idtypes() == ('Late', 'Late')
+
+
+def test_jb_property_doc():
+    prop = jb_property(lambda self: 1, doc='The answer.')
+    assert prop.__doc__ == 'The answer.'
+    assert jb_property.__doc__ == 'An annotated property.'